@@ -0,0 +1,196 @@
+import os
+import time
+import threading
+from flask import request, g
+
+'''
+Admission control
+    caps how many requests a worker process runs at once. Requests are
+    sorted into four pools, each with its own concurrency limit:
+        list    the expensive list endpoints (GET /actors, GET /movies)
+        stream  the change feed (GET /changes), whose long-polls and SSE
+                streams hold a thread for seconds to minutes
+        read    every other GET/HEAD request
+        write   POST/PATCH/PUT/DELETE requests
+    When a pool is full, a request waits in a bounded queue until a slot
+    frees up or its deadline passes. If the queue is full or the deadline
+    passes it is shed with a 503 and a Retry-After header, instead of
+    piling up until gunicorn kills the worker. The stream pool has no
+    queue: a feed request that finds it full is shed right away.
+'''
+
+
+class Overloaded(Exception):
+    def __init__(self, pool, retry_after):
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class AdmissionPool(object):
+    def __init__(self, name, limit, queue_size, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.reset()
+
+    def reset(self):
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    def acquire(self):
+        with self.cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue_size:
+                self.shed += 1
+                return False
+
+            self.waiting += 1
+            self.queued += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        return False
+                    self.cond.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'queue_size': self.queue_size,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed': self.shed,
+                'timed_out': self.timed_out,
+            }
+
+
+def _classify(app):
+    if request.endpoint is None \
+            or request.endpoint in app.config['ADMISSION_EXEMPT_ENDPOINTS']:
+        return None
+    if request.endpoint in app.config['ADMISSION_STREAM_ENDPOINTS']:
+        return 'stream'
+    if request.method in ('GET', 'HEAD'):
+        if request.endpoint in app.config['ADMISSION_LIST_ENDPOINTS']:
+            return 'list'
+        return 'read'
+    return 'write'
+
+
+'''
+admission_stats(app)
+    returns the queue depth and shed counters of every pool
+'''
+
+
+def admission_stats(app):
+    pools = app.extensions.get('admission', {})
+    return {name: pool.stats() for name, pool in pools.items()}
+
+
+'''
+reset_admission(app)
+    drops in-flight counters, e.g. in a freshly forked worker
+'''
+
+
+def reset_admission(app):
+    for pool in app.extensions.get('admission', {}).values():
+        pool.reset()
+
+
+'''
+setup_admission(app)
+    installs admission control on a flask application.
+    Settings come from app.config, then the environment:
+        ADMISSION_ENABLED        turn the layer on/off (default on)
+        ADMISSION_READ_LIMIT     concurrent read requests per process
+        ADMISSION_WRITE_LIMIT    concurrent write requests per process
+        ADMISSION_LIST_LIMIT     concurrent list requests per process
+        ADMISSION_STREAM_LIMIT   concurrent change feed requests per
+                                 process, below the thread count
+        ADMISSION_QUEUE_SIZE     requests allowed to wait, per pool;
+                                 waiters hold a server thread, so keep
+                                 it well below the thread count
+        ADMISSION_QUEUE_TIMEOUT  seconds a queued request may wait
+        ADMISSION_RETRY_AFTER    Retry-After seconds sent with a 503
+'''
+
+
+def setup_admission(app):
+    app.config.setdefault('ADMISSION_ENABLED',
+                          os.environ.get('ADMISSION_ENABLED', '1') != '0')
+    app.config.setdefault('ADMISSION_READ_LIMIT',
+                          int(os.environ.get('ADMISSION_READ_LIMIT', 8)))
+    app.config.setdefault('ADMISSION_WRITE_LIMIT',
+                          int(os.environ.get('ADMISSION_WRITE_LIMIT', 4)))
+    app.config.setdefault('ADMISSION_LIST_LIMIT',
+                          int(os.environ.get('ADMISSION_LIST_LIMIT', 2)))
+    app.config.setdefault('ADMISSION_STREAM_LIMIT',
+                          int(os.environ.get('ADMISSION_STREAM_LIMIT', 2)))
+    app.config.setdefault('ADMISSION_QUEUE_SIZE',
+                          int(os.environ.get('ADMISSION_QUEUE_SIZE', 4)))
+    app.config.setdefault('ADMISSION_QUEUE_TIMEOUT',
+                          float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2)))
+    app.config.setdefault('ADMISSION_RETRY_AFTER',
+                          int(os.environ.get('ADMISSION_RETRY_AFTER', 1)))
+    app.config.setdefault('ADMISSION_LIST_ENDPOINTS',
+                          {'get_actors', 'get_movies'})
+    app.config.setdefault('ADMISSION_STREAM_ENDPOINTS', {'get_changes'})
+    app.config.setdefault('ADMISSION_EXEMPT_ENDPOINTS', {'metrics', 'static'})
+
+    if not app.config['ADMISSION_ENABLED']:
+        return
+
+    queue_size = app.config['ADMISSION_QUEUE_SIZE']
+    timeout = app.config['ADMISSION_QUEUE_TIMEOUT']
+    app.extensions['admission'] = {
+        name: AdmissionPool(name, app.config[limit], queue_size, timeout)
+        for name, limit in (('read', 'ADMISSION_READ_LIMIT'),
+                            ('write', 'ADMISSION_WRITE_LIMIT'),
+                            ('list', 'ADMISSION_LIST_LIMIT'))
+    }
+    # a stream slot is held for a whole long-poll or SSE stream (the
+    # request context lives until the stream ends), so nothing queues
+    app.extensions['admission']['stream'] = AdmissionPool(
+        'stream', app.config['ADMISSION_STREAM_LIMIT'], 0, timeout)
+
+    @app.before_request
+    def admit_request():
+        name = _classify(app)
+        if name is None:
+            return
+        pool = app.extensions['admission'][name]
+        if not pool.acquire():
+            raise Overloaded(name, app.config['ADMISSION_RETRY_AFTER'])
+        g.admission_pool = pool
+
+    @app.teardown_request
+    def release_request(exc):
+        pool = g.pop('admission_pool', None)
+        if pool is not None:
+            pool.release()
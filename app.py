@@ -1,40 +1,218 @@
 import os
-from flask import Flask, request, abort, jsonify
+import math
+from flask import Flask, request, abort, current_app
 from flask_sqlalchemy import SQLAlchemy
-from flask_cors import CORS
-from models import Movie, Actor, setup_db
-from auth.auth import *
+from models import db, Movie, Actor, Stat, setup_db, flush_inserts, utcnow, \
+    rows_changed_after
+from json_provider import jsonify, setup_json
+from compression import setup_compression
+from cors import setup_cors
+from admission import setup_admission, admission_stats, reset_admission, \
+    Overloaded
+from change_feed import setup_change_feed, entities_for, long_poll, \
+    event_stream, ChangesPruned
+from rate_limit import setup_rate_limit, rate_limit_stats, rate_limit, \
+    reset_rate_limit, RateLimited
+from row_cache import setup_row_cache
+from group_commit import setup_group_commit
+from auth.auth import AuthError, requires_auth, clear_caches, \
+    warm_jwks_cache
 
 import sys
-
-
-def create_app(test_config=None):
+import time
+from datetime import datetime, timedelta, timezone
+
+'''
+parse_timestamp(value)
+    ISO 8601 string (e.g. 2020-08-04T03:48:13Z) to a naive UTC datetime,
+    None if it cannot be parsed
+'''
+
+
+def parse_timestamp(value):
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+'''
+delta_sync(model, name)
+    body of GET /<name>?updated_since=<timestamp>: rows created or
+    updated after the timestamp plus the ids deleted since then.
+    `next_updated_since` is the value to send on the next sync.
+
+    updated_at is stamped when a write starts, not when it commits, so
+    a slow write can commit with an updated_at older than rows a sync
+    already returned. The cursor therefore never passes DELTA_SYNC_LAG
+    seconds behind the database clock: the next sync returns the rows
+    of that window again (clients apply them by id) along with any
+    late commit.
+'''
+
+
+def delta_sync(model, name):
+    since = parse_timestamp(request.args.get('updated_since'))
+    if since is None:
+        abort(400)
+
+    rows = model.changed_since(since)
+    horizon = db.session.query(utcnow()).scalar() - timedelta(
+        seconds=current_app.config['DELTA_SYNC_LAG'])
+    cursor = min(rows[-1].updated_at if rows else since, horizon)
+    return {
+        'success': True,
+        name: [row.serialize() for row in rows if row.deleted_at is None],
+        'deleted_ids': [row.id for row in rows if row.deleted_at is not None],
+        'next_updated_since': cursor.isoformat() + 'Z',
+    }
+
+
+'''
+parse_ids(value)
+    '1,2,3' to [1, 2, 3]; aborts with 400 when malformed and 422 when
+    more than MULTI_GET_MAX_IDS ids are asked for
+'''
+
+
+def parse_ids(value):
+    try:
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        abort(400)
+    if not ids:
+        abort(400)
+    if len(ids) > current_app.config['MULTI_GET_MAX_IDS']:
+        abort(422)
+    return ids
+
+
+'''
+reset_after_fork(app)
+    drops the per-process state a worker must not share with the
+    process it was forked from: pooled DB connections, the JWKS/token
+    caches, admission and rate limit counters and the row and group
+    commit state, then warms the JWKS cache if JWKS_WARMUP is set.
+    Called from gunicorn's post_fork hook.
+'''
+
+
+def reset_after_fork(app):
+    with app.app_context():
+        db.engine.dispose()
+    clear_caches()
+    reset_admission(app)
+    reset_rate_limit(app)
+    app.extensions['row_cache'].reset()
+    app.extensions['group_commit'].reset()
+    if app.config['JWKS_WARMUP']:
+        warm_jwks_cache()
+
+
+def create_app(test_config=None, json_provider=None):
+    started = time.perf_counter()
     # create and configure the app
     app = Flask(__name__)
+    if test_config is not None:
+        app.config.update(test_config)
     setup_db(app)
 
     '''
-     Set up CORS. Allow '*' for origins.
+     Encode every response (including errors) through a pluggable
+     JSON provider, orjson when installed and stdlib json otherwise.
+    '''
+    setup_json(app, json_provider)
+
+    '''
+     Negotiate gzip/br compression for large bodies and cache the
+     compressed form of ETagged GET responses.
+    '''
+    setup_compression(app)
+
+    '''
+     Set up CORS from CORS_ORIGINS and answer preflights before auth
+     and DB work, with Access-Control-Max-Age so browsers cache them.
+    '''
+    setup_cors(app)
+
+    '''
+     Per-process admission control: separate concurrency limits for
+     read, write and list routes, a bounded wait queue and fast 503s.
+    '''
+    setup_admission(app)
+
+    '''
+     Per-token rate limits keyed by the JWT sub and permission class.
+    '''
+    setup_rate_limit(app)
+
+    '''
+     Change feed settings (long-poll and Server-Sent Events).
+    '''
+    setup_change_feed(app)
+
+    '''
+     Per-process cache of serialized rows for single-item and multi-get
+     reads, invalidated by the Actor/Movie write methods and, for writes
+     on other workers, from the change log.
+    '''
+    setup_row_cache(app, rows_changed_after)
+    app.config.setdefault('MULTI_GET_MAX_IDS',
+                          int(os.environ.get('MULTI_GET_MAX_IDS', 100)))
+    app.config.setdefault('DELTA_SYNC_LAG',
+                          float(os.environ.get('DELTA_SYNC_LAG', 10)))
+
+    '''
+     Opt-in group commit: concurrent POSTs in a worker share one
+     transaction.
+    '''
+    setup_group_commit(app, flush_inserts)
+
+    '''
+     Optionally fetch the Auth0 JWKS in the background so the first
+     authenticated request does not pay for it. This happens in
+     reset_after_fork, never here: the gunicorn master preloads the
+     app and must have no threads running when it forks the workers.
     '''
-    CORS(app)
+    app.config.setdefault('JWKS_WARMUP',
+                          os.environ.get('JWKS_WARMUP', '0') == '1')
 
     '''
-    Set Access-Control-Allow after_request decorator
+        GET /metrics
+        admission control queue depth and shed counters, rate limit,
+        row cache and group commit counters of this process, and how
+        long create_app took
+        it has no auth, so it responds with a 404 error unless
+        METRICS_ENABLED is set (only where it is not publicly reachable)
     '''
+    app.config.setdefault('METRICS_ENABLED',
+                          os.environ.get('METRICS_ENABLED', '0') == '1')
 
-    @app.after_request
-    def after_request(response):
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers',
-                             'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods',
-                             'GET,PUT,POST,PATCH,DELETE')
-        return response
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if not app.config['METRICS_ENABLED']:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'admission': admission_stats(app),
+            'rate_limit': rate_limit_stats(app),
+            'row_cache': app.extensions['row_cache'].stats(),
+            'group_commit': app.extensions['group_commit'].stats(),
+            'startup_ms': app.extensions['startup_ms'],
+        }), 200
 
     '''
          GET /actors
          To fetches all available actors
           It should require the 'get:actors' permission
+         GET /actors?updated_since=<timestamp>
+          only the actors changed after <timestamp> and the deleted ids
+         GET /actors?ids=<id>,<id>,...
+          only the listed actors, fetched in one query
     '''
 
     @app.route('/', methods=['GET'])
@@ -46,11 +224,41 @@ def create_app(test_config=None):
 
     @app.route('/actors', methods=['GET'])
     @requires_auth('get:actors')
+    @rate_limit('read')
     def get_actors(token):
+        if 'updated_since' in request.args:
+            return jsonify(delta_sync(Actor, 'actors')), 200
+        if 'ids' in request.args:
+            return jsonify({
+                'success': True,
+                'actors': Actor.find_serialized(
+                    parse_ids(request.args['ids'])),
+            }), 200
 
         return jsonify({
             'success': True,
-            'actors': list(map(lambda a: a.serialize(), Actor.query.all())),
+            'actors': list(map(lambda a: a.serialize(),
+                               Actor.live().order_by(Actor.id).all())),
+        }), 200
+
+    '''
+        GET /actors/<id>
+            where <id> is the existing model id
+            it should respond with a 404 error if <id> is not found
+            it should require the 'get:actors' permission
+    '''
+
+    @app.route('/actors/<int:actor_id>', methods=['GET'])
+    @requires_auth('get:actors')
+    @rate_limit('read')
+    def get_actor(token, actor_id):
+        actors = Actor.find_serialized([actor_id])
+        if not actors:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'actor': actors[0],
         }), 200
 
     '''
@@ -61,6 +269,7 @@ def create_app(test_config=None):
 
     @app.route('/actors', methods=['POST'])
     @requires_auth('post:actors')
+    @rate_limit('write')
     def create_actor(token):
         actor_data = request.get_json()
         if actor_data is None:
@@ -91,8 +300,9 @@ def create_app(test_config=None):
 
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('patch:actors')
+    @rate_limit('write')
     def update_actor(token, actor_id):
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+        actor = Actor.live().filter(Actor.id == actor_id).one_or_none()
         if actor is None:
             abort(404)
 
@@ -129,9 +339,10 @@ def create_app(test_config=None):
 
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actors')
+    @rate_limit('write')
     def delete_actor(token, actor_id):
 
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+        actor = Actor.live().filter(Actor.id == actor_id).one_or_none()
 
         if actor is None:
             abort(404)
@@ -150,16 +361,47 @@ def create_app(test_config=None):
     GET /movies
     To fetches all available movies
     It should require the 'get:movies' permission
+    GET /movies?updated_since=<timestamp>
+    only the movies changed after <timestamp> and the deleted ids
     '''
 
     @app.route('/movies', methods=['GET'])
     @requires_auth('get:movies')
+    @rate_limit('read')
     def get_movies(token):
+        if 'updated_since' in request.args:
+            return jsonify(delta_sync(Movie, 'movies')), 200
+        if 'ids' in request.args:
+            return jsonify({
+                'success': True,
+                'movies': Movie.find_serialized(
+                    parse_ids(request.args['ids'])),
+            }), 200
 
         return jsonify({
             'success': True,
             'movies': list(map(lambda m: m.serialize(),
-                               Movie.query.order_by(Movie.id).all())),
+                               Movie.live().order_by(Movie.id).all())),
+        }), 200
+
+    '''
+        GET /movies/<id>
+            where <id> is the existing model id
+            it should respond with a 404 error if <id> is not found
+            it should require the 'get:movies' permission
+    '''
+
+    @app.route('/movies/<int:movie_id>', methods=['GET'])
+    @requires_auth('get:movies')
+    @rate_limit('read')
+    def get_movie(token, movie_id):
+        movies = Movie.find_serialized([movie_id])
+        if not movies:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'movie': movies[0],
         }), 200
 
     '''
@@ -170,6 +412,7 @@ def create_app(test_config=None):
 
     @app.route('/movies', methods=['POST'])
     @requires_auth('post:movies')
+    @rate_limit('write')
     def create_movie(token):
 
         movie_data = request.get_json()
@@ -198,9 +441,10 @@ def create_app(test_config=None):
 
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('patch:movies')
+    @rate_limit('write')
     def update_movie(token, movie_id):
 
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        movie = Movie.live().filter(Movie.id == movie_id).one_or_none()
 
         if movie is None:
             abort(404)
@@ -237,9 +481,10 @@ def create_app(test_config=None):
      '''
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movies')
+    @rate_limit('write')
     def delete_movie(token, movie_id):
 
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        movie = Movie.live().filter(Movie.id == movie_id).one_or_none()
 
         if movie is None:
             abort(404)
@@ -253,6 +498,75 @@ def create_app(test_config=None):
         except Exception:
             abort(500)
 
+    '''
+        GET /changes?since=<seq>
+            changes to actors and movies after <seq>, oldest first
+            ?wait=<seconds> long-polls until a change arrives
+            Accept: text/event-stream streams changes as Server-Sent Events
+            it should respond with a 410 error (or a `reset` event) if
+            changes after <seq> were pruned
+            it should require the 'get:actors' permission, movie changes
+            are only included with the 'get:movies' permission
+    '''
+
+    @app.route('/changes', methods=['GET'])
+    @requires_auth('get:actors')
+    @rate_limit('read')
+    def get_changes(token):
+        since = request.args.get('since', 0, type=int)
+        wait = request.args.get('wait', 0, type=float)
+        if not math.isfinite(wait):
+            abort(400)
+        entities = entities_for(token)
+
+        if request.accept_mimetypes.best == 'text/event-stream':
+            since = request.headers.get('Last-Event-ID', since, type=int)
+            return event_stream(since, entities)
+
+        changes = long_poll(since, entities, wait)
+        return jsonify({
+            'success': True,
+            'changes': changes,
+            'last_seq': changes[-1]['seq'] if changes else since,
+        }), 200
+
+    '''
+        GET /stats/actors
+            actor counts in total, by gender and by age bracket
+            it should require the 'get:actors' permission
+    '''
+
+    @app.route('/stats/actors', methods=['GET'])
+    @requires_auth('get:actors')
+    @rate_limit('read')
+    def get_actor_stats(token):
+        summary = Stat.summary('actors')
+
+        return jsonify({
+            'success': True,
+            'total': summary.get('total', {}).get('all', 0),
+            'by_gender': summary.get('gender', {}),
+            'by_age': summary.get('age', {}),
+        }), 200
+
+    '''
+        GET /stats/movies
+            movie counts in total and by release year
+            it should require the 'get:movies' permission
+    '''
+
+    @app.route('/stats/movies', methods=['GET'])
+    @requires_auth('get:movies')
+    @rate_limit('read')
+    def get_movie_stats(token):
+        summary = Stat.summary('movies')
+
+        return jsonify({
+            'success': True,
+            'total': summary.get('total', {}).get('all', 0),
+            'by_release_year': summary.get('release_year', {}),
+        }), 200
+
     '''
     Create error handlers for all expected errors
     including 404 ,422 ,500 ,400.
@@ -294,9 +608,57 @@ def create_app(test_config=None):
     def auth_error(e):
         return jsonify(e.error), e.status_code
 
+    @app.errorhandler(Overloaded)
+    def overloaded(e):
+        response = jsonify({
+            "success": False,
+            "error": 503,
+            "message": "Service Unavailable"
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+
+    @app.errorhandler(RateLimited)
+    def rate_limited(e):
+        response = jsonify({
+            "success": False,
+            "error": 429,
+            "message": "Too Many Requests"
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    @app.errorhandler(ChangesPruned)
+    def changes_pruned(e):
+        return jsonify(dict(e.serialize(), **{
+            "success": False,
+            "error": 410,
+            "message": "Gone"
+        })), 410
+
+    app.extensions['startup_ms'] = \
+        round((time.perf_counter() - started) * 1000, 1)
     return app
 
-APP = create_app()
+
+'''
+APP
+    built on first access instead of at import, so importing this
+    module (tests, manage.py, gunicorn's master) has no side effects.
+    gunicorn runs `app:create_app()` directly.
+'''
+
+_app = None
+
+
+def __getattr__(name):
+    global _app
+    if name == 'APP':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(name)
+
 
 if __name__ == '__main__':
-    APP.run(host='0.0.0.0', port=8080, debug=True)
+    create_app().run(host='0.0.0.0', port=8080, debug=True)
@@ -1,14 +1,106 @@
 import os
 import json
+import time
+import threading
+from collections import OrderedDict
 from flask import request
 from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
 
 AUTH0_DOMAIN = 'dev-gxqb4md6.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'api-fsnd-capstone'
 
+# seconds the Auth0 JWKS is reused before it is fetched again
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 600))
+# an unknown kid refetches the JWKS at most this often (key rotation)
+JWKS_MIN_REFRESH = int(os.environ.get('JWKS_MIN_REFRESH', 60))
+# verified tokens remembered until they expire
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+
+'''
+JWKS and token caches
+    the JWKS is fetched once per JWKS_CACHE_TTL instead of on every
+    request, and a token that already verified is not decoded again
+    until its `exp`. Both are per process; clear_caches() resets them,
+    e.g. in a freshly forked worker, and warm_jwks_cache() fills the
+    JWKS cache in the background so the first request does not wait.
+    jose and urllib.request are imported on first use to keep import
+    time (worker boot, test collection, manage.py) down.
+'''
+
+_jwks_cache = {'jwks': None, 'fetched_at': 0}
+_jwks_lock = threading.Lock()
+_token_cache = OrderedDict()
+_token_lock = threading.Lock()
+
+
+def clear_caches():
+    global _jwks_lock, _token_lock
+    _jwks_lock = threading.Lock()
+    _token_lock = threading.Lock()
+    _jwks_cache['jwks'] = None
+    _jwks_cache['fetched_at'] = 0
+    _token_cache.clear()
+
+
+'''
+get_jwks(refresh)
+    the Auth0 JWKS, from the cache while it is fresh. `refresh` forces
+    a fetch, unless the cached one is younger than JWKS_MIN_REFRESH.
+'''
+
+
+def get_jwks(refresh=False):
+    age = time.monotonic() - _jwks_cache['fetched_at']
+    if _jwks_cache['jwks'] is not None and age < JWKS_CACHE_TTL \
+            and not (refresh and age >= JWKS_MIN_REFRESH):
+        return _jwks_cache['jwks']
+
+    with _jwks_lock:
+        # another thread may have fetched it while we waited
+        if time.monotonic() - _jwks_cache['fetched_at'] < age:
+            return _jwks_cache['jwks']
+        from urllib.request import urlopen
+        jsonurl = urlopen(f'http://{AUTH0_DOMAIN}/.well-known/jwks.json')
+        _jwks_cache['jwks'] = json.loads(jsonurl.read())
+        _jwks_cache['fetched_at'] = time.monotonic()
+        return _jwks_cache['jwks']
+
+
+def warm_jwks_cache():
+    def warm():
+        try:
+            get_jwks()
+        except Exception:
+            # the first request fetches it again
+            pass
+
+    thread = threading.Thread(target=warm, name='jwks-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def _cached_payload(token):
+    with _token_lock:
+        payload = _token_cache.get(token)
+        if payload is None:
+            return None
+        if payload.get('exp', 0) <= time.time():
+            del _token_cache[token]
+            return None
+        _token_cache.move_to_end(token)
+        return payload
+
+
+def _cache_payload(token, payload):
+    if TOKEN_CACHE_SIZE <= 0 or 'exp' not in payload:
+        return
+    with _token_lock:
+        _token_cache[token] = payload
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+
 '''
 AuthError Exception
 A standardized way to communicate auth failure modes
@@ -88,9 +180,13 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
+    payload = _cached_payload(token)
+    if payload is not None:
+        return payload
+
+    from jose import jwt
 
-    jsonurl = urlopen(f'http://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    jwks = get_jwks()
 
     unverified_header = jwt.get_unverified_header(token)
 
@@ -103,6 +199,11 @@ def verify_decode_jwt(token):
             'error': 401,
         }, 401)
 
+    if not any(key['kid'] == unverified_header['kid']
+               for key in jwks['keys']):
+        # keys may have rotated since the JWKS was cached
+        jwks = get_jwks(refresh=True)
+
     for key in jwks['keys']:
         if key['kid'] == unverified_header['kid']:
             rsa_key = {
@@ -124,6 +225,7 @@ def verify_decode_jwt(token):
                 audience=API_AUDIENCE,
                 issuer='https://' + AUTH0_DOMAIN + '/'
             )
+            _cache_payload(token, payload)
 
             return payload
 
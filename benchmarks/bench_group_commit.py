@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'bench_group_commit.db'))
+
+from app import create_app
+from models import db, Actor
+
+'''
+Compare creates per second of the per-request commit path against
+group commit, with concurrent threads inserting actors the way a
+threaded worker would. Uses DATABASE_URL, or a temporary sqlite file.
+
+    python benchmarks/bench_group_commit.py [threads] [creates per thread]
+'''
+
+
+def run(app, threads, creates):
+    errors = []
+
+    def worker():
+        with app.app_context():
+            for i in range(creates):
+                try:
+                    Actor(name='bench', age=i % 90, gender='F').insert()
+                except Exception as e:
+                    errors.append(e)
+            db.session.remove()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return threads * creates / elapsed, len(errors)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    creates = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    for name, group_commit in (('per-request', False),
+                               ('group commit', True)):
+        app = create_app({'GROUP_COMMIT': group_commit})
+        with app.app_context():
+            db.create_all()
+        rate, errors = run(app, threads, creates)
+        print('%-13s %3d threads %8.1f creates/s %4d errors' % (
+            name, threads, rate, errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from flask import Flask
+from json_provider import JSONProvider, OrjsonProvider
+
+'''
+Compare encode throughput of the JSON providers on large actor and
+movie lists, shaped like the GET /actors and GET /movies payloads.
+
+    python benchmarks/bench_json.py [rows] [repeat]
+'''
+
+
+def make_actors(rows):
+    return [{
+        'id': i,
+        'name': 'Actor %d' % i,
+        'age': 20 + i % 60,
+        'gender': 'M' if i % 2 else 'F',
+    } for i in range(rows)]
+
+
+def make_movies(rows):
+    return [{
+        'id': i,
+        'title': 'Movie title number %d' % i,
+        'release': '20%02d-01-01' % (i % 100),
+    } for i in range(rows)]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    providers = [('stdlib', JSONProvider())]
+    try:
+        providers.append(('orjson', OrjsonProvider()))
+    except ImportError:
+        print('orjson not installed, only benchmarking stdlib')
+
+    payloads = [
+        ('actors', {'success': True, 'actors': make_actors(rows)}),
+        ('movies', {'success': True, 'movies': make_movies(rows)}),
+    ]
+
+    app = Flask(__name__)
+    with app.app_context():
+        for payload_name, payload in payloads:
+            for name, provider in providers:
+                size = len(provider.dumps(payload))
+                best = min(timeit.repeat(lambda: provider.dumps(payload),
+                                         number=1, repeat=repeat))
+                print('%-7s %-7s %7d rows %9d bytes %8.2f ms '
+                      '%9.1f MB/s' % (payload_name, name, rows, size,
+                                      best * 1000, size / best / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from flask import Flask
+from rate_limit import RateLimiter, MemoryBackend, SQLiteBackend, \
+    RateLimited
+
+'''
+Measure the per-request overhead of the rate limiter, i.e. one
+RateLimiter.check() call, for each backend and for a spread of callers.
+
+    python benchmarks/bench_rate_limit.py [calls] [subjects]
+'''
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    subjects = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    backends = [('memory', MemoryBackend())]
+    path = os.path.join(tempfile.mkdtemp(), 'rate_limit.db')
+    backends.append(('sqlite', SQLiteBackend(path)))
+
+    app = Flask(__name__)
+    with app.test_request_context():
+        for name, backend in backends:
+            # generous limits so every call takes the allowed path
+            limiter = RateLimiter(backend, {'read': (10 ** 9, 1)})
+            keys = ['user-%d' % i for i in range(subjects)]
+            state = {'i': 0}
+
+            def check():
+                state['i'] += 1
+                try:
+                    limiter.check(keys[state['i'] % subjects], 'read')
+                except RateLimited:
+                    pass
+
+            number = calls if name == 'memory' else calls // 100
+            best = min(timeit.repeat(check, number=number, repeat=3))
+            print('%-7s %8d calls %8.2f us/call' % (
+                name, number, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
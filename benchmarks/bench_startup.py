@@ -0,0 +1,75 @@
+import os
+import sys
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+'''
+Track cold-start latency: time `import app` and `create_app()` in fresh
+interpreters, which is what a worker boot, test collection or a
+manage.py command pays. Run with --imports to also list the slowest
+imports (python -X importtime).
+
+    python benchmarks/bench_startup.py [runs] [--imports]
+'''
+
+STEPS = {
+    'import app': 'import app',
+    'create_app()': 'import app; app.create_app()',
+}
+
+TIMER = '''
+import time
+started = time.perf_counter()
+{}
+print((time.perf_counter() - started) * 1000)
+'''
+
+
+def measure(code, env):
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=ROOT, env=env)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def slowest_imports(env, count=10):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import app'], cwd=ROOT, env=env,
+                            stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    rows = []
+    for line in result.stderr.decode().splitlines():
+        # "import time: <self us> | <cumulative us> | <indented name>"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        # one level below `app`, i.e. what app.py itself pulls in
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    runs = int(args[0]) if args else 10
+
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'bench_startup.db'))
+    env['JWKS_WARMUP'] = '0'
+
+    for name, code in STEPS.items():
+        timings = [measure(TIMER.format(code), env) for _ in range(runs)]
+        print('%-13s median %7.1f ms  min %7.1f ms  max %7.1f ms' % (
+            name, statistics.median(timings), min(timings), max(timings)))
+
+    if '--imports' in sys.argv:
+        print('\nslowest imports (cumulative):')
+        for cumulative_us, name in slowest_imports(env):
+            print('%9.1f ms  %s' % (cumulative_us / 1000, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import threading
+from flask import Response, stream_with_context, current_app
+from models import db, Change, wait_for_change, notify_change
+
+'''
+Change feed
+    serves the change log to clients that only want deltas, in two modes:
+        long-poll  GET /changes?since=<seq>&wait=<seconds>
+                   returns right away when changes exist, otherwise
+                   holds the request until one arrives or `wait` expires
+        SSE        GET /changes?since=<seq> with
+                   Accept: text/event-stream streams each change as an
+                   event with id=<seq>; reconnecting clients resume from
+                   their Last-Event-ID
+    A write committed in this process wakes waiters right away. Writes
+    from other workers are picked up every CHANGES_POLL_INTERVAL seconds.
+    A `since` older than the pruned history raises ChangesPruned: the
+    client has missed changes and must re-fetch the full lists.
+
+    When the worker starts shutting down (see watch_shutdown()), open
+    long-polls return and SSE streams end with a final `retry:`, so
+    clients reconnect to another worker instead of being cut off at
+    the graceful timeout.
+'''
+
+shutting_down = threading.Event()
+
+
+class ChangesPruned(Exception):
+    def __init__(self, oldest_seq, latest_seq):
+        self.oldest_seq = oldest_seq
+        self.latest_seq = latest_seq
+
+    def serialize(self):
+        return {
+            'reset': True,
+            'oldest_seq': self.oldest_seq,
+            'latest_seq': self.latest_seq,
+        }
+
+
+def entities_for(payload):
+    permissions = payload.get('permissions', [])
+    return [entity for entity in ('actors', 'movies')
+            if 'get:' + entity in permissions]
+
+
+def _read(since, entities, limit):
+    changes = [c.serialize() for c in Change.since(since, entities, limit)]
+    # checked after the read, so a prune that raced it is still caught
+    pruned = Change.pruned_through()
+    latest = Change.latest_seq() if since < pruned else None
+    # end the read transaction so the next poll sees new commits
+    db.session.rollback()
+    if latest is not None:
+        raise ChangesPruned(pruned + 1, latest)
+    return changes
+
+
+'''
+watch_shutdown(stopping, interval)
+    starts a thread that checks `stopping()` every `interval` seconds
+    and, once it returns True, ends the open long-polls and streams
+'''
+
+
+def watch_shutdown(stopping, interval=0.5):
+    def watch():
+        while not stopping():
+            time.sleep(interval)
+        shutting_down.set()
+        notify_change()
+
+    thread = threading.Thread(target=watch, name='shutdown-watch',
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait(deadline):
+    interval = current_app.config['CHANGES_POLL_INTERVAL']
+    remaining = deadline - time.monotonic()
+    if remaining > 0:
+        wait_for_change(min(interval, remaining))
+
+
+'''
+long_poll(since, entities, wait)
+    returns changes after `since`, waiting up to `wait` seconds
+    (capped by CHANGES_MAX_WAIT) for the first one to arrive
+'''
+
+
+def long_poll(since, entities, wait):
+    config = current_app.config
+    limit = config['CHANGES_PAGE_SIZE']
+    wait = min(max(wait, 0), config['CHANGES_MAX_WAIT'])
+    deadline = time.monotonic() + wait
+    while True:
+        changes = _read(since, entities, limit)
+        if changes or time.monotonic() >= deadline \
+                or shutting_down.is_set():
+            return changes
+        _wait(deadline)
+
+
+'''
+event_stream(since, entities)
+    Server-Sent Events response streaming changes after `since`. The
+    stream ends after CHANGES_STREAM_TIMEOUT seconds so workers are not
+    pinned forever; EventSource clients reconnect on their own. When
+    `since` falls in pruned history, a `reset` event carrying
+    ChangesPruned.serialize() ends the stream.
+'''
+
+
+def event_stream(since, entities):
+    config = current_app.config
+    limit = config['CHANGES_PAGE_SIZE']
+
+    def generate(since):
+        deadline = time.monotonic() + config['CHANGES_STREAM_TIMEOUT']
+        heartbeat = config['CHANGES_HEARTBEAT']
+        yield 'retry: %d\n\n' % (config['CHANGES_POLL_INTERVAL'] * 1000)
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline and not shutting_down.is_set():
+            try:
+                changes = _read(since, entities, limit)
+            except ChangesPruned as e:
+                yield 'event: reset\ndata: %s\n\n' % json.dumps(
+                    e.serialize(), separators=(',', ':'))
+                return
+            for change in changes:
+                since = change['seq']
+                yield 'id: %d\nevent: change\ndata: %s\n\n' % (
+                    since, json.dumps(change, separators=(',', ':')))
+            if changes:
+                last_sent = time.monotonic()
+                continue
+            if time.monotonic() - last_sent >= heartbeat:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            _wait(deadline)
+        if shutting_down.is_set():
+            # worker is going away; reconnect (to another worker) now
+            yield ': shutting down\nretry: %d\n\n' % (
+                config['CHANGES_POLL_INTERVAL'] * 1000)
+
+    response = Response(stream_with_context(generate(since)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+'''
+setup_change_feed(app)
+    change feed settings, from app.config then the environment:
+        CHANGES_PAGE_SIZE       most changes returned per response/poll
+        CHANGES_MAX_WAIT        longest long-poll, in seconds
+        CHANGES_POLL_INTERVAL   seconds between polls for other workers
+        CHANGES_HEARTBEAT       seconds between SSE keep-alive comments
+        CHANGES_STREAM_TIMEOUT  seconds before an SSE stream is closed
+        CHANGES_RETENTION_DAYS  age at which `manage.py prune_changes`
+                                drops changes
+'''
+
+
+def setup_change_feed(app):
+    app.config.setdefault('CHANGES_PAGE_SIZE',
+                          int(os.environ.get('CHANGES_PAGE_SIZE', 500)))
+    app.config.setdefault('CHANGES_MAX_WAIT',
+                          float(os.environ.get('CHANGES_MAX_WAIT', 25)))
+    app.config.setdefault('CHANGES_POLL_INTERVAL',
+                          float(os.environ.get('CHANGES_POLL_INTERVAL', 1)))
+    app.config.setdefault('CHANGES_HEARTBEAT',
+                          float(os.environ.get('CHANGES_HEARTBEAT', 15)))
+    app.config.setdefault('CHANGES_STREAM_TIMEOUT',
+                          float(os.environ.get('CHANGES_STREAM_TIMEOUT', 300)))
+    app.config.setdefault('CHANGES_RETENTION_DAYS',
+                          int(os.environ.get('CHANGES_RETENTION_DAYS', 7)))
@@ -0,0 +1,135 @@
+import os
+import gzip
+import threading
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+Response compression
+    negotiates gzip (and br when the brotli package is installed) from
+    Accept-Encoding, skips bodies below COMPRESS_MIN_SIZE and tags GET
+    responses with a weak ETag. Compressed bodies are cached by
+    (etag, encoding, level) so an unchanged list is compressed once per
+    version instead of once per request.
+'''
+
+
+class _CompressedCache(object):
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def _compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level)
+
+
+def _choose_encoding(accept_encodings):
+    gzip_q = accept_encodings['gzip']
+    br_q = accept_encodings['br'] if brotli is not None else 0
+    if br_q and br_q >= gzip_q:
+        return 'br'
+    if gzip_q:
+        return 'gzip'
+    return None
+
+
+'''
+setup_compression(app)
+    registers the compression after_request hook on a flask application.
+    Settings come from app.config, then the environment:
+        COMPRESS_LEVEL       gzip level, 1-9 (default 6)
+        COMPRESS_BR_LEVEL    brotli quality, 0-11 (default 4)
+        COMPRESS_MIN_SIZE    smallest body in bytes worth compressing
+        COMPRESS_MIMETYPES   list of mimetypes to compress
+        COMPRESS_CACHE_SIZE  number of compressed bodies kept per process
+'''
+
+
+def setup_compression(app):
+    app.config.setdefault('COMPRESS_LEVEL',
+                          int(os.environ.get('COMPRESS_LEVEL', 6)))
+    app.config.setdefault('COMPRESS_BR_LEVEL',
+                          int(os.environ.get('COMPRESS_BR_LEVEL', 4)))
+    app.config.setdefault('COMPRESS_MIN_SIZE',
+                          int(os.environ.get('COMPRESS_MIN_SIZE', 500)))
+    app.config.setdefault('COMPRESS_MIMETYPES', ['application/json'])
+    app.config.setdefault('COMPRESS_CACHE_SIZE',
+                          int(os.environ.get('COMPRESS_CACHE_SIZE', 64)))
+
+    cache = _CompressedCache(app.config['COMPRESS_CACHE_SIZE'])
+    app.extensions['compression_cache'] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if response.direct_passthrough or response.is_streamed \
+                or response.mimetype not in app.config['COMPRESS_MIMETYPES']:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        etag = None
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            response.add_etag(weak=True)
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+            etag, _ = response.get_etag()
+
+        if 'Content-Encoding' in response.headers \
+                or not 200 <= response.status_code < 300:
+            return response
+
+        encoding = _choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        if encoding == 'br':
+            level = app.config['COMPRESS_BR_LEVEL']
+        else:
+            level = app.config['COMPRESS_LEVEL']
+
+        compressed = None
+        if etag is not None:
+            key = (etag, encoding, level)
+            compressed = cache.get(key)
+        if compressed is None:
+            compressed = _compress(data, encoding, level)
+            if etag is not None:
+                cache.set(key, compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,54 @@
+import os
+from flask import request
+from flask_cors import CORS
+
+'''
+CORS
+    a single flask_cors layer configured from app.config / the environment:
+        CORS_ORIGINS        allowed origins, comma separated (default '*')
+        CORS_MAX_AGE        seconds browsers may cache a preflight
+        CORS_ALLOW_HEADERS  request headers allowed on cross-origin calls
+        CORS_METHODS        methods allowed on cross-origin calls
+        CORS_EXPOSE_HEADERS response headers readable by the browser
+    Preflight requests are answered by the first before_request hook, so
+    they never reach auth, admission control or the database.
+'''
+
+
+def _split(value):
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return value
+
+
+def is_preflight():
+    return request.method == 'OPTIONS' \
+        and 'Access-Control-Request-Method' in request.headers
+
+
+'''
+setup_cors(app)
+    installs CORS headers and the preflight short-circuit on a flask app
+'''
+
+
+def setup_cors(app):
+    app.config.setdefault('CORS_ORIGINS',
+                          _split(os.environ.get('CORS_ORIGINS', '*')))
+    app.config.setdefault('CORS_MAX_AGE',
+                          int(os.environ.get('CORS_MAX_AGE', 86400)))
+    app.config.setdefault('CORS_ALLOW_HEADERS',
+                          ['Content-Type', 'Authorization'])
+    app.config.setdefault('CORS_METHODS',
+                          ['GET', 'PUT', 'POST', 'PATCH', 'DELETE'])
+    app.config.setdefault('CORS_EXPOSE_HEADERS',
+                          ['RateLimit-Limit', 'RateLimit-Remaining',
+                           'RateLimit-Reset', 'Retry-After'])
+    app.config['CORS_ORIGINS'] = _split(app.config['CORS_ORIGINS'])
+
+    @app.before_request
+    def answer_preflight():
+        if is_preflight():
+            return app.make_default_options_response()
+
+    CORS(app)
@@ -0,0 +1,156 @@
+import os
+import time
+import threading
+
+'''
+Group commit
+    gathers records submitted concurrently by a worker's threads and
+    hands them to `flush` as one batch, so N requests pay for one
+    commit instead of N.
+
+    The first submitter becomes the batch leader. It waits up to
+    `window` seconds, or until `max_batch` records are queued, then
+    flushes the batch in its own thread while the others wait on their
+    entry. If records are left over, the leader promotes the oldest one
+    to lead the next batch. `flush(records)` returns one error (or None)
+    per record, and submit() re-raises that record's error in its caller.
+
+    A follower waits at most `timeout` seconds, so a stuck flush does not
+    hang every create in the worker. It then raises GroupCommitTimeout;
+    if its record was already in the stuck batch, that record may still
+    be committed later.
+'''
+
+
+class GroupCommitTimeout(Exception):
+    pass
+
+
+class _Pending(object):
+    def __init__(self, record):
+        self.record = record
+        self.done = threading.Event()
+        self.promoted = False
+        self.error = None
+
+
+class GroupCommitter(object):
+    def __init__(self, flush, window=0.005, max_batch=32, timeout=10):
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.cond = threading.Condition()
+        self.pending = []
+        self.leading = False
+        self.batches = 0
+        self.records = 0
+        self.timeouts = 0
+
+    def submit(self, record):
+        entry = _Pending(record)
+        with self.cond:
+            self.pending.append(entry)
+            lead = not self.leading
+            if lead:
+                self.leading = True
+            elif len(self.pending) >= self.max_batch:
+                self.cond.notify_all()
+
+        if not lead:
+            if not entry.done.wait(self.timeout):
+                self._abandon(entry)
+            if entry.promoted:
+                entry.done.clear()
+                lead = True
+        if lead:
+            # the leader's own entry is always first in its batch
+            self._lead()
+
+        if entry.error is not None:
+            raise entry.error
+
+    def _abandon(self, entry):
+        with self.cond:
+            if entry.done.is_set():
+                # flushed or promoted just as the wait timed out
+                return
+            self.timeouts += 1
+            if entry in self.pending:
+                self.pending.remove(entry)
+                raise GroupCommitTimeout('still queued after %ss'
+                                         % self.timeout)
+        raise GroupCommitTimeout('batch not flushed within %ss'
+                                 % self.timeout)
+
+    def _lead(self):
+        deadline = time.monotonic() + self.window
+        with self.cond:
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = self.pending[:self.max_batch]
+            self.pending = self.pending[self.max_batch:]
+            if self.pending:
+                successor = self.pending[0]
+                successor.promoted = True
+                successor.done.set()
+            else:
+                self.leading = False
+
+        try:
+            errors = self.flush([entry.record for entry in batch])
+        except Exception as e:
+            errors = [e] * len(batch)
+        with self.cond:
+            self.batches += 1
+            self.records += len(batch)
+        for entry, error in zip(batch, errors):
+            entry.error = error
+            entry.promoted = False
+            entry.done.set()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'enabled': self.enabled,
+                'batches': self.batches,
+                'records': self.records,
+                'queued': len(self.pending),
+                'timeouts': self.timeouts,
+            }
+
+
+'''
+setup_group_commit(app, flush)
+    gives the app its own committer for `flush`, in
+    app.extensions['group_commit'], configured from app.config then
+    the environment:
+        GROUP_COMMIT            opt in to group commit (default off)
+        GROUP_COMMIT_WINDOW_MS  longest a batch waits to fill up
+        GROUP_COMMIT_MAX_BATCH  records flushed per transaction
+        GROUP_COMMIT_TIMEOUT    longest a follower waits for its batch
+'''
+
+
+def setup_group_commit(app, flush):
+    app.config.setdefault('GROUP_COMMIT',
+                          os.environ.get('GROUP_COMMIT', '0') == '1')
+    app.config.setdefault('GROUP_COMMIT_WINDOW_MS',
+                          float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 5)))
+    app.config.setdefault('GROUP_COMMIT_MAX_BATCH',
+                          int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 32)))
+    app.config.setdefault('GROUP_COMMIT_TIMEOUT',
+                          float(os.environ.get('GROUP_COMMIT_TIMEOUT', 10)))
+    committer = GroupCommitter(flush,
+                               app.config['GROUP_COMMIT_WINDOW_MS'] / 1000.0,
+                               app.config['GROUP_COMMIT_MAX_BATCH'],
+                               app.config['GROUP_COMMIT_TIMEOUT'])
+    committer.enabled = app.config['GROUP_COMMIT']
+    app.extensions['group_commit'] = committer
@@ -0,0 +1,83 @@
+import os
+import multiprocessing
+
+'''
+Gunicorn server configuration
+    gunicorn --config gunicorn.conf.py 'app:create_app()'
+
+    The app is imported once in the master (preload_app) and workers
+    share its memory copy-on-write. post_fork then resets the state a
+    worker must not inherit: pooled DB connections, the JWKS/token
+    caches and the in-process limiter and cache state.
+
+    Graceful reloads: SIGTERM (what Heroku sends on deploy) stops
+    accepting connections and gives in-flight requests graceful_timeout
+    seconds to finish. Because the app is preloaded, SIGHUP restarts
+    workers but does not load new code. To deploy new code on a host
+    without dropping requests, send USR2 to start a new master next to
+    the old one, then WINCH and QUIT to the old master once the new
+    workers are up.
+
+    SSE streams on /changes can last CHANGES_STREAM_TIMEOUT (300s),
+    longer than graceful_timeout. When a worker starts shutting down
+    (SIGTERM, reload or max_requests), post_worker_init's watcher ends
+    its streams and long-polls with a final `retry:` so clients
+    reconnect on purpose instead of being cut off.
+'''
+
+# fetch the Auth0 JWKS in the background as each worker boots (in
+# post_fork, not in the master)
+os.environ.setdefault('JWKS_WARMUP', '1')
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+
+# threads let one worker overlap DB and JWKS waits; group commit and
+# admission control only come into play with more than one thread
+threads = int(os.environ.get('GUNICORN_THREADS', min(cpu_count * 2, 8)))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# 2 x CPUs + 1 is the rule for sync workers; threaded workers already
+# overlap waits, so one per CPU. Heroku sets WEB_CONCURRENCY from the
+# dyno size, since cpu_count() reports the host's CPUs there
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             cpu_count if threads > 1 else cpu_count * 2 + 1))
+
+# one DB connection per thread plus a little headroom (the group commit
+# leader uses its own session). Each worker has its own pool, so the
+# database sees up to workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# connections, which must stay under its max_connections (100 by
+# default on postgres).
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+
+# a queued request holds a thread while it waits. With the three pools
+# queueing at most threads // 4 each, waiters never take all threads,
+# so a full pool sheds with 503s instead of starving the others
+os.environ.setdefault('ADMISSION_QUEUE_SIZE', str(threads // 4))
+# long-polls and SSE streams hold their thread for up to minutes
+os.environ.setdefault('ADMISSION_STREAM_LIMIT', str(max(threads // 4, 1)))
+os.environ.setdefault('DB_MAX_OVERFLOW', '2')
+
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# longer than the longest /changes long-poll (CHANGES_MAX_WAIT)
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 35))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# recycle workers now and then, staggered so they do not all restart
+# at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    from app import reset_after_fork
+    reset_after_fork(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    # gunicorn clears worker.alive on SIGTERM and on max_requests
+    from change_feed import watch_shutdown
+    watch_shutdown(lambda: not worker.alive)
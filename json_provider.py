@@ -0,0 +1,103 @@
+import json
+from flask import current_app
+
+'''
+JSON providers
+    encode API payloads straight to bytes and wrap them in a response.
+    JSONProvider uses the standard library encoder, OrjsonProvider uses
+    orjson when it is installed. Both fall back to the app's json_encoder
+    for types they do not handle natively (dates, uuids, ...) so the
+    output is the same whichever one is active.
+'''
+
+
+class JSONProvider(object):
+    def dumps(self, obj):
+        app = current_app
+        indent = None
+        separators = (',', ':')
+        if app.config.get('JSONIFY_PRETTYPRINT_REGULAR') or app.debug:
+            indent = 2
+            separators = (',', ': ')
+        return json.dumps(obj,
+                          cls=app.json_encoder,
+                          sort_keys=app.config.get('JSON_SORT_KEYS', True),
+                          ensure_ascii=app.config.get('JSON_AS_ASCII', True),
+                          indent=indent,
+                          separators=separators).encode('utf-8')
+
+    def response(self, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed '
+                            'both args and kwargs')
+        if len(args) == 1:
+            data = args[0]
+        else:
+            data = args or kwargs
+        return current_app.response_class(
+            self.dumps(data),
+            mimetype=current_app.config.get('JSONIFY_MIMETYPE',
+                                            'application/json'))
+
+
+class OrjsonProvider(JSONProvider):
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj):
+        app = current_app
+        option = self.orjson.OPT_NON_STR_KEYS \
+            | self.orjson.OPT_PASSTHROUGH_DATETIME
+        if app.config.get('JSON_SORT_KEYS', True):
+            option |= self.orjson.OPT_SORT_KEYS
+        if app.config.get('JSONIFY_PRETTYPRINT_REGULAR') or app.debug:
+            option |= self.orjson.OPT_INDENT_2
+        try:
+            return self.orjson.dumps(obj,
+                                     default=app.json_encoder().default,
+                                     option=option)
+        except self.orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits
+            return super(OrjsonProvider, self).dumps(obj)
+
+
+'''
+default_provider()
+    returns the fastest provider available in this environment
+'''
+
+
+def default_provider():
+    try:
+        return OrjsonProvider()
+    except ImportError:
+        return JSONProvider()
+
+
+'''
+setup_json(app, provider)
+    binds a JSON provider to a flask application,
+    picking default_provider() when none is given
+'''
+
+
+def setup_json(app, provider=None):
+    if provider is None:
+        provider = default_provider()
+    app.extensions['json_provider'] = provider
+
+
+'''
+jsonify(*args, **kwargs)
+    drop-in replacement for flask.jsonify that encodes through the
+    provider bound to the current app
+'''
+
+
+def jsonify(*args, **kwargs):
+    provider = current_app.extensions.get('json_provider')
+    if provider is None:
+        provider = current_app.extensions['json_provider'] = \
+            default_provider()
+    return provider.response(*args, **kwargs)
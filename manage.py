@@ -1,7 +1,8 @@
+from datetime import datetime, timedelta
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from app import create_app
-from models import db, Actor, Movie
+from models import db, Actor, Movie, Change, Stat
 
 app = create_app()
 
@@ -10,5 +11,28 @@ manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
+
+@manager.command
+def compact_changes(days=1):
+    """Drop superseded change log entries older than `days` days"""
+    before = datetime.utcnow() - timedelta(days=float(days))
+    print('compacted %d changes' % Change.compact(before))
+
+
+@manager.command
+def prune_changes(days=None):
+    """Drop change log entries older than the retention period"""
+    if days is None:
+        days = app.config['CHANGES_RETENTION_DAYS']
+    before = datetime.utcnow() - timedelta(days=float(days))
+    print('pruned %d changes' % Change.prune(before))
+
+
+@manager.command
+def rebuild_stats():
+    """Recompute the /stats counters from the actors and movies tables"""
+    print('rebuilt %d stats counters' % Stat.rebuild())
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,35 @@
+"""change log
+
+Revision ID: 4cc3c17721e1
+Revises: 5418ddfb3deb
+Create Date: 2026-10-19 17:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4cc3c17721e1'
+down_revision = '5418ddfb3deb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('changes',
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('data', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('seq')
+    )
+    op.create_index(op.f('ix_changes_created_at'), 'changes',
+                    ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_changes_created_at'), table_name='changes')
+    op.drop_table('changes')
@@ -0,0 +1,54 @@
+"""timestamps and soft deletes
+
+Revision ID: 9b2e61f0c8a4
+Revises: 4cc3c17721e1
+Create Date: 2026-10-19 18:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e61f0c8a4'
+down_revision = '4cc3c17721e1'
+branch_labels = None
+depends_on = None
+
+
+# the database clock in UTC, like models.utcnow()
+UTC_NOW = {
+    'postgresql': "TIMEZONE('utc', CURRENT_TIMESTAMP)",
+    'sqlite': 'CURRENT_TIMESTAMP',
+}
+
+
+def upgrade():
+    now = UTC_NOW.get(op.get_bind().dialect.name, 'CURRENT_TIMESTAMP')
+    for table in ('actors', 'movies'):
+        # added as nullable and backfilled, since sqlite cannot add a
+        # NOT NULL column with a non-constant default; existing rows get
+        # the migration time
+        op.add_column(table, sa.Column('created_at', sa.DateTime(),
+                                       nullable=True))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(),
+                                       nullable=True))
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(),
+                                       nullable=True))
+        op.execute('UPDATE %s SET created_at = %s, updated_at = %s'
+                   % (table, now, now))
+        with op.batch_alter_table(table) as batch:
+            batch.alter_column('created_at', existing_type=sa.DateTime(),
+                               nullable=False)
+            batch.alter_column('updated_at', existing_type=sa.DateTime(),
+                               nullable=False)
+        op.create_index(op.f('ix_%s_updated_at' % table), table,
+                        ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('movies', 'actors'):
+        op.drop_index(op.f('ix_%s_updated_at' % table), table_name=table)
+        op.drop_column(table, 'deleted_at')
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'created_at')
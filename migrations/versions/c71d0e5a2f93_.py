@@ -0,0 +1,60 @@
+"""stats summary table
+
+Revision ID: c71d0e5a2f93
+Revises: 9b2e61f0c8a4
+Create Date: 2026-10-19 18:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71d0e5a2f93'
+down_revision = '9b2e61f0c8a4'
+branch_labels = None
+depends_on = None
+
+# bucket expressions matching Actor/Movie.stat_buckets()
+AGE_DECADE = ('(CASE WHEN age < 0 THEN (age - 9) / 10 '
+              'ELSE age / 10 END) * 10')
+STARTS_WITH_YEAR = {
+    'postgresql': "release ~ '^[0-9]{4}'",
+    'sqlite': "release GLOB '[0-9][0-9][0-9][0-9]*'",
+}
+
+
+def count_into_stats(metric, table, bucket):
+    op.execute(
+        "INSERT INTO stats (metric, bucket, count) "
+        "SELECT '%s', bucket, COUNT(*) FROM "
+        "(SELECT %s AS bucket FROM %s WHERE deleted_at IS NULL) AS live "
+        "GROUP BY bucket" % (metric, bucket, table))
+
+
+def upgrade():
+    op.create_table('stats',
+    sa.Column('metric', sa.String(length=40), nullable=False),
+    sa.Column('bucket', sa.String(length=40), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'bucket')
+    )
+    # count the existing rows; from here on the model write methods keep
+    # the counters up to date
+    count_into_stats('actors.total', 'actors', "'all'")
+    count_into_stats('actors.gender', 'actors',
+                     "COALESCE(NULLIF(gender, ''), 'unknown')")
+    count_into_stats('actors.age', 'actors',
+                     "CASE WHEN age IS NULL THEN 'unknown' "
+                     "ELSE CAST(%s AS VARCHAR) || '-' || "
+                     "CAST(%s + 9 AS VARCHAR) END" % (AGE_DECADE, AGE_DECADE))
+    count_into_stats('movies.total', 'movies', "'all'")
+    year = STARTS_WITH_YEAR.get(op.get_bind().dialect.name,
+                                "release REGEXP '^[0-9]{4}'")
+    count_into_stats('movies.release_year', 'movies',
+                     "CASE WHEN %s THEN SUBSTR(release, 1, 4) "
+                     "ELSE 'unknown' END" % year)
+
+
+def downgrade():
+    op.drop_table('stats')
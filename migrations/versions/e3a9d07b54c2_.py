@@ -0,0 +1,36 @@
+"""change log prune mark
+
+Revision ID: e3a9d07b54c2
+Revises: c71d0e5a2f93
+Create Date: 2026-10-20 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9d07b54c2'
+down_revision = 'c71d0e5a2f93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    mark = op.create_table('change_prune_mark',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(mark, [{'id': 1, 'seq': 0}])
+    # sqlite reuses the rowid of deleted rows unless the table is
+    # AUTOINCREMENT, which would hand out pruned seqs again
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table(
+                'changes', recreate='always',
+                table_kwargs={'sqlite_autoincrement': True}):
+            pass
+
+
+def downgrade():
+    op.drop_table('change_prune_mark')
@@ -1,19 +1,44 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import threading
+from collections import OrderedDict, Counter
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, create_engine, inspect, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from flask_sqlalchemy import SQLAlchemy
 import json
 import sys
-database_path = os.environ['DATABASE_URL']
 
 db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service.
+    The database URL is resolved here rather than at import: the
+    argument, then SQLALCHEMY_DATABASE_URI, then $DATABASE_URL.
+    The DB driver is only imported when the first connection is made.
+    The connection pool is sized from app.config, then the environment:
+        DB_POOL_SIZE     connections kept open per process
+        DB_MAX_OVERFLOW  extra connections opened under load
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None):
+    if database_path is None:
+        database_path = app.config.get('SQLALCHEMY_DATABASE_URI') \
+            or os.environ.get('DATABASE_URL')
+    if not database_path:
+        raise RuntimeError('DATABASE_URL is not set')
+    app.config.setdefault('DB_POOL_SIZE',
+                          int(os.environ.get('DB_POOL_SIZE', 5)))
+    app.config.setdefault('DB_MAX_OVERFLOW',
+                          int(os.environ.get('DB_MAX_OVERFLOW', 10)))
+    if not database_path.startswith('sqlite'):
+        # sqlite uses its own pool classes, which take neither option
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        })
     try:
         app.config["SQLALCHEMY_DATABASE_URI"] = database_path
         app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
@@ -24,12 +49,419 @@ def setup_db(app, database_path=database_path):
 
 
 
+'''
+Change log
+    append-only record of every insert/update/delete on actors and
+    movies. `seq` is a monotonic sequence clients resume from.
+'''
+
+
+class Change(db.Model):
+    __tablename__ = 'changes'
+    # never hand out a pruned seq again (sqlite reuses rowids otherwise)
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    data = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=datetime.utcnow)
+
+    def serialize(self):
+        return {
+            'seq': self.seq,
+            'entity': self.entity,
+            'id': self.entity_id,
+            'op': self.op,
+            'data': json.loads(self.data) if self.data else None,
+            'created_at': self.created_at.isoformat() + 'Z',
+        }
+
+    '''
+    Change.since(seq, entities, limit)
+        changes after `seq` for the given entity names, oldest first
+    '''
+
+    @classmethod
+    def since(cls, seq, entities, limit):
+        return cls.query.filter(cls.seq > seq,
+                                cls.entity.in_(entities)) \
+            .order_by(cls.seq).limit(limit).all()
+
+    '''
+    Change.compact(before)
+        drops changes older than `before` that a later change of the
+        same row supersedes; replaying the rest gives the same state
+    '''
+
+    @classmethod
+    def compact(cls, before):
+        latest = db.session.query(db.func.max(cls.seq)) \
+            .group_by(cls.entity, cls.entity_id)
+        deleted = cls.query.filter(cls.created_at < before,
+                                   ~cls.seq.in_(latest)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    '''
+    Change.prune(before)
+        drops every change older than `before` (retention)
+    '''
+
+    @classmethod
+    def prune(cls, before):
+        through = db.session.query(db.func.max(cls.seq)) \
+            .filter(cls.created_at < before).scalar()
+        if through is None:
+            return 0
+        deleted = cls.query.filter(cls.seq <= through) \
+            .delete(synchronize_session=False)
+        # remember how far history goes back, see pruned_through()
+        mark = ChangePruneMark.query.get(1)
+        if mark is None:
+            db.session.add(ChangePruneMark(id=1, seq=through))
+        else:
+            mark.seq = max(mark.seq, through)
+        db.session.commit()
+        return deleted
+
+    '''
+    Change.pruned_through()
+        highest seq dropped by prune(), 0 if nothing was pruned. A client
+        resuming from an older seq has missed changes.
+    '''
+
+    @classmethod
+    def pruned_through(cls):
+        mark = ChangePruneMark.query.get(1)
+        return mark.seq if mark is not None else 0
+
+    @classmethod
+    def latest_seq(cls):
+        latest = db.session.query(db.func.max(cls.seq)).scalar() or 0
+        return max(latest, cls.pruned_through())
+
+
+'''
+rows_changed_after(seq)
+    row cache poll: the newest change log seq and the (table, id) of
+    every row changed after `seq`, including by other workers
+'''
+
+
+def rows_changed_after(seq):
+    if seq is None:
+        return Change.latest_seq(), []
+    changes = db.session.query(Change.seq, Change.entity, Change.entity_id) \
+        .filter(Change.seq > seq).order_by(Change.seq).all()
+    if not changes:
+        return seq, []
+    return changes[-1].seq, [(c.entity, c.entity_id) for c in changes]
+
+
+'''
+ChangePruneMark
+    a single row (id 1) holding the highest seq Change.prune() dropped
+'''
+
+
+class ChangePruneMark(db.Model):
+    __tablename__ = 'change_prune_mark'
+
+    id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, nullable=False, default=0)
+
+
+change_notifier = threading.Condition()
+
+
+def notify_change():
+    with change_notifier:
+        change_notifier.notify_all()
+
+
+'''
+wait_for_change(timeout)
+    blocks until a write in this process commits or `timeout` expires.
+    Writes from other worker processes are only seen by polling.
+'''
+
+
+def wait_for_change(timeout):
+    with change_notifier:
+        change_notifier.wait(timeout)
+
+
+def _log_change(session, record, op):
+    # serialize appends on postgres so `seq` order matches commit order
+    # and readers resuming from a seq never skip a late commit
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute('SELECT pg_advisory_xact_lock(4242)')
+    session.add(Change(entity=record.__tablename__,
+                       entity_id=record.id,
+                       op=op,
+                       data=json.dumps(record.serialize())
+                       if op != 'delete' else None))
+
+
+'''
+Stat
+    summary table behind GET /stats/*: one counter per (metric, bucket),
+    e.g. ('actors.gender', 'F'). The Actor/Movie write methods keep the
+    counters up to date in the same transaction as the row itself.
+    Stat.rebuild() recomputes them all from the tables.
+'''
+
+
+class Stat(db.Model):
+    __tablename__ = 'stats'
+
+    metric = db.Column(db.String(40), primary_key=True)
+    bucket = db.Column(db.String(40), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    '''
+    Stat.summary(entity)
+        {metric: {bucket: count}} for one entity, e.g. 'actors';
+        reads only the stats rows, whatever the size of the table
+    '''
+
+    @classmethod
+    def summary(cls, entity):
+        summary = {}
+        for stat in cls.query.filter(cls.metric.like(entity + '.%')):
+            if stat.count:
+                metric = stat.metric[len(entity) + 1:]
+                summary.setdefault(metric, {})[stat.bucket] = stat.count
+        return summary
+
+    '''
+    Stat.rebuild()
+        recomputes every counter from the live actors and movies rows
+    '''
+
+    @classmethod
+    def rebuild(cls):
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute('SELECT pg_advisory_xact_lock(4242)')
+        counts = Counter()
+        for model in (Actor, Movie):
+            for row in model.live().yield_per(1000):
+                counts.update(row.stat_buckets())
+        cls.query.delete(synchronize_session=False)
+        db.session.add_all([cls(metric=metric, bucket=bucket, count=count)
+                            for (metric, bucket), count in counts.items()])
+        db.session.commit()
+        return len(counts)
+
+
+def _bump_stats(session, deltas):
+    dialect = session.get_bind().dialect.name
+    for (metric, bucket), delta in deltas.items():
+        if not delta:
+            continue
+        params = {'metric': metric, 'bucket': bucket, 'delta': delta}
+        if dialect in ('postgresql', 'sqlite'):
+            session.execute(text(
+                'INSERT INTO stats (metric, bucket, count) '
+                'VALUES (:metric, :bucket, :delta) '
+                'ON CONFLICT (metric, bucket) '
+                'DO UPDATE SET count = stats.count + excluded.count'),
+                params)
+            continue
+        updated = session.execute(text(
+            'UPDATE stats SET count = count + :delta '
+            'WHERE metric = :metric AND bucket = :bucket'), params)
+        if not updated.rowcount:
+            session.add(Stat(metric=metric, bucket=bucket, count=delta))
+
+
+# value of `attr` before the pending, unflushed changes to `record`
+def _previous(record, attr):
+    history = inspect(record).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(record, attr)
+
+
+def _age_bucket(age):
+    try:
+        decade = int(age) // 10 * 10
+    except (TypeError, ValueError):
+        return 'unknown'
+    return '%d-%d' % (decade, decade + 9)
+
+
+def _release_year(release):
+    year = str(release or '')[:4]
+    return year if len(year) == 4 and year.isdigit() else 'unknown'
+
+
+'''
+flush_inserts(records)
+    group commit flush: inserts a batch of new Actor/Movie rows in one
+    transaction. If the batch fails, each record is retried in its own
+    transaction so only the bad ones get an error. The session does not
+    expire on commit, so rows handed back to other request threads keep
+    their loaded attributes (id included) once detached.
+'''
+
+
+def flush_inserts(records):
+    session = db.create_session({'expire_on_commit': False})()
+    try:
+        try:
+            for record in records:
+                record._stage_insert(session)
+            session.commit()
+            errors = [None] * len(records)
+        except Exception:
+            session.rollback()
+            errors = []
+            for record in records:
+                try:
+                    session.expunge_all()
+                    record._stage_insert(session)
+                    session.commit()
+                    errors.append(None)
+                except Exception as e:
+                    session.rollback()
+                    errors.append(e)
+    finally:
+        session.close()
+    notify_change()
+    return errors
+
+
+# the app's row cache and group committer, see setup_row_cache() and
+# setup_group_commit()
+def _extension(name):
+    return db.get_app().extensions[name]
+
+
+'''
+utcnow()
+    the database clock in UTC, as a SQL expression. Timestamps that
+    sync cursors compare are taken from it rather than from each
+    worker's clock.
+'''
+
+
+class utcnow(FunctionElement):
+    type = db.DateTime()
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    # UTC on sqlite
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+'''
+CatalogMixin
+    timestamps and insert/update/delete shared by Actor and Movie.
+    Deletes are soft: the row is kept as a tombstone with deleted_at
+    set, so delta syncs can report it. Each write appends to the change
+    log and adjusts the stats counters in the same transaction.
+'''
+
+
+class CatalogMixin(object):
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=utcnow(), onupdate=utcnow())
+    deleted_at = db.Column(db.DateTime)
+
+    '''
+    live()
+        query of the rows that are not deleted
+    '''
+
+    @classmethod
+    def live(cls):
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    '''
+    changed_since(since)
+        rows created, updated or deleted after `since`, oldest first;
+        a range scan on the updated_at index
+    '''
+
+    @classmethod
+    def changed_since(cls, since):
+        return cls.query.filter(cls.updated_at > since) \
+            .order_by(cls.updated_at, cls.id).all()
+
+    '''
+    find_serialized(ids)
+        serialized live rows for `ids`, in the order asked for. Rows
+        come from the row cache where possible; the rest are loaded with
+        a single WHERE id IN query and cached.
+    '''
+
+    @classmethod
+    def find_serialized(cls, ids):
+        ids = list(OrderedDict.fromkeys(ids))
+        row_cache = _extension('row_cache')
+        found, generation = row_cache.get_many(cls.__tablename__, ids)
+        missing = [row_id for row_id in ids if row_id not in found]
+        if missing:
+            loaded = {row.id: row.serialize() for row in
+                      cls.live().filter(cls.id.in_(missing)).all()}
+            row_cache.put_many(cls.__tablename__, loaded, generation)
+            found.update(loaded)
+        return [found[row_id] for row_id in ids if row_id in found]
+
+    def _stage_insert(self, session):
+        session.add(self)
+        session.flush()
+        _log_change(session, self, 'insert')
+        _bump_stats(session, Counter(self.stat_buckets()))
+
+    def insert(self):
+        committer = _extension('group_commit')
+        if committer.enabled:
+            committer.submit(self)
+            return
+        self._stage_insert(db.session)
+        db.session.commit()
+        notify_change()
+
+    def update(self):
+        deltas = Counter(self.stat_buckets())
+        deltas.subtract(self.stat_buckets(_previous))
+        _log_change(db.session, self, 'update')
+        _bump_stats(db.session, deltas)
+        db.session.commit()
+        _extension('row_cache').invalidate(self.__tablename__, self.id)
+        notify_change()
+
+    def delete(self):
+        self.deleted_at = self.updated_at = utcnow()
+        _log_change(db.session, self, 'delete')
+        deltas = Counter()
+        deltas.subtract(self.stat_buckets())
+        _bump_stats(db.session, deltas)
+        db.session.commit()
+        _extension('row_cache').invalidate(self.__tablename__, self.id)
+        notify_change()
+
+
 '''
 Act or entity 
 '''
 
 
-class Actor(db.Model):
+class Actor(CatalogMixin, db.Model):
     __tablename__ = 'actors'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -42,16 +474,16 @@ class Actor(db.Model):
         self.age = age
         self.gender = gender
 
-    def insert(self):
-        db.session.add(self)
-        db.session.commit()
-
-    def update(self):
-        db.session.commit()
+    '''
+    stat_buckets(get)
+        the (metric, bucket) counters this row adds to; `get` reads an
+        attribute, so update() can pass _previous for the old buckets
+    '''
 
-    def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+    def stat_buckets(self, get=getattr):
+        return [('actors.total', 'all'),
+                ('actors.gender', get(self, 'gender') or 'unknown'),
+                ('actors.age', _age_bucket(get(self, 'age')))]
 
     def serialize(self):
         return {
@@ -67,7 +499,7 @@ Movie entity
 '''
 
 
-class Movie(db.Model):
+class Movie(CatalogMixin, db.Model):
     __tablename__ = 'movies'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -78,16 +510,9 @@ class Movie(db.Model):
         self.title = title
         self.release = release
 
-    def insert(self):
-        db.session.add(self)
-        db.session.commit()
-
-    def update(self):
-        db.session.commit()
-
-    def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+    def stat_buckets(self, get=getattr):
+        return [('movies.total', 'all'),
+                ('movies.release_year', _release_year(get(self, 'release')))]
 
     def serialize(self):
         return {
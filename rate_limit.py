@@ -0,0 +1,265 @@
+import os
+import math
+import time
+import threading
+from functools import wraps
+from flask import current_app, g
+
+'''
+Rate limiting
+    per-token limits keyed by the JWT `sub` claim and a permission class
+    ('read' or 'write'). Each key has a token bucket, implemented as GCRA
+    (generic cell rate algorithm), so the only state per key is one float:
+    the theoretical arrival time (tat) of the next request.
+
+    Backends, picked by RATE_LIMIT_STORAGE_URL:
+        memory://            in-process dict, the default. It takes no
+                             lock: a get and a set per request, so racing
+                             threads can at worst let one extra request in
+        sqlite:///path/file  local stand-in for a shared store. Every
+                             worker on the host shares one file, so limits
+                             hold across workers
+        redis://host:port/n  shared across hosts (needs the redis package)
+'''
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+
+
+# returns (allowed, new_tat, remaining, reset_after, retry_after)
+def _gcra(tat, now, interval, burst):
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - burst * interval
+    if now < allow_at:
+        return False, tat, 0, tat - now, allow_at - now
+    remaining = int((now - allow_at) / interval)
+    return True, new_tat, remaining, new_tat - now, 0
+
+
+class MemoryBackend(object):
+    def __init__(self):
+        self.tats = {}
+
+    def hit(self, key, interval, burst):
+        now = time.monotonic()
+        allowed, tat, remaining, reset_after, retry_after = \
+            _gcra(self.tats.get(key), now, interval, burst)
+        if allowed:
+            self.tats[key] = tat
+        return allowed, remaining, reset_after, retry_after
+
+    def reset(self):
+        self.tats = {}
+
+
+class SQLiteBackend(object):
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        connection = self._connect()
+        connection.execute('CREATE TABLE IF NOT EXISTS rate_limit '
+                           '(key TEXT PRIMARY KEY, tat REAL)')
+        connection.close()
+
+    def _connect(self):
+        import sqlite3
+        connection = sqlite3.connect(self.path, timeout=5,
+                                     isolation_level=None)
+        # buckets are cheap to lose, so trade durability for latency
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        return connection
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self._connect()
+        return connection
+
+    def hit(self, key, interval, burst):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tat FROM rate_limit '
+                                     'WHERE key = ?', (key,)).fetchone()
+            now = time.time()
+            allowed, tat, remaining, reset_after, retry_after = \
+                _gcra(row[0] if row else None, now, interval, burst)
+            if allowed:
+                connection.execute('INSERT OR REPLACE INTO rate_limit '
+                                   '(key, tat) VALUES (?, ?)', (key, tat))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, remaining, reset_after, retry_after
+
+    def reset(self):
+        self.local = threading.local()
+
+
+class RedisBackend(object):
+    # GCRA as a Lua script so the read-modify-write is atomic in redis
+    SCRIPT = '''
+    local interval = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+    if tat < now then tat = now end
+    local new_tat = tat + interval
+    local allow_at = new_tat - burst * interval
+    if now < allow_at then
+        return {0, 0, tostring(tat - now), tostring(allow_at - now)}
+    end
+    redis.call('SET', KEYS[1], tostring(new_tat),
+               'PX', math.ceil((new_tat - now) * 1000))
+    return {1, math.floor((now - allow_at) / interval),
+            tostring(new_tat - now), '0'}
+    '''
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def hit(self, key, interval, burst):
+        allowed, remaining, reset_after, retry_after = \
+            self.script(keys=['rate_limit:' + key], args=[interval, burst])
+        return bool(allowed), int(remaining), float(reset_after), \
+            float(retry_after)
+
+    def reset(self):
+        self.client.connection_pool.reset()
+
+
+def make_backend(url):
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBackend(url)
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    raise ValueError('Unsupported RATE_LIMIT_STORAGE_URL: ' + url)
+
+
+# '120/60' -> (120, 60.0), 120 requests per 60 seconds
+def parse_limit(value):
+    if isinstance(value, str):
+        count, _, period = value.partition('/')
+        return int(count), float(period or 60)
+    return value
+
+
+class RateLimiter(object):
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, subject, permission_class):
+        count, period = self.limits[permission_class]
+        allowed, remaining, reset_after, retry_after = self.backend.hit(
+            '%s:%s' % (subject, permission_class), period / count, count)
+        g.rate_limit = (count, remaining, reset_after)
+        if not allowed:
+            self.limited += 1
+            raise RateLimited(int(math.ceil(retry_after)))
+        self.allowed += 1
+
+    def stats(self):
+        return {'allowed': self.allowed, 'limited': self.limited}
+
+
+'''
+@rate_limit(permission_class)
+    @INPUTS
+        permission_class: 'read' or 'write'
+    goes right under @requires_auth and takes the JWT `sub` from the
+    payload requires_auth passes to the handler. Raises RateLimited
+    once the caller's bucket for that permission class is empty.
+'''
+
+
+def rate_limit(permission_class):
+    def rate_limit_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            limiter = current_app.extensions.get('rate_limit')
+            if limiter is not None:
+                limiter.check(payload.get('sub'), permission_class)
+            return f(payload, *args, **kwargs)
+
+        return wrapper
+
+    return rate_limit_decorator
+
+
+'''
+rate_limit_stats(app)
+    returns how many requests were allowed and limited by this process
+'''
+
+
+def rate_limit_stats(app):
+    limiter = app.extensions.get('rate_limit')
+    return limiter.stats() if limiter is not None else {}
+
+
+'''
+reset_rate_limit(app)
+    drops buckets and connections inherited from a parent process
+'''
+
+
+def reset_rate_limit(app):
+    limiter = app.extensions.get('rate_limit')
+    if limiter is not None:
+        limiter.backend.reset()
+
+
+'''
+setup_rate_limit(app)
+    installs the rate limiter on a flask application.
+    Settings come from app.config, then the environment:
+        RATE_LIMIT_ENABLED      turn the layer on/off (default on)
+        RATE_LIMIT_READ         'requests/seconds' for read permissions
+        RATE_LIMIT_WRITE        'requests/seconds' for write permissions
+        RATE_LIMIT_STORAGE_URL  memory://, sqlite:///path or redis://...
+'''
+
+
+def setup_rate_limit(app):
+    app.config.setdefault('RATE_LIMIT_ENABLED',
+                          os.environ.get('RATE_LIMIT_ENABLED', '1') != '0')
+    app.config.setdefault('RATE_LIMIT_READ',
+                          os.environ.get('RATE_LIMIT_READ', '300/60'))
+    app.config.setdefault('RATE_LIMIT_WRITE',
+                          os.environ.get('RATE_LIMIT_WRITE', '60/60'))
+    app.config.setdefault('RATE_LIMIT_STORAGE_URL',
+                          os.environ.get('RATE_LIMIT_STORAGE_URL',
+                                         'memory://'))
+
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return
+
+    app.extensions['rate_limit'] = RateLimiter(
+        make_backend(app.config['RATE_LIMIT_STORAGE_URL']), {
+            'read': parse_limit(app.config['RATE_LIMIT_READ']),
+            'write': parse_limit(app.config['RATE_LIMIT_WRITE']),
+        })
+
+    @app.after_request
+    def add_rate_limit_headers(response):
+        limit = g.pop('rate_limit', None)
+        if limit is not None:
+            count, remaining, reset_after = limit
+            response.headers['RateLimit-Limit'] = str(count)
+            response.headers['RateLimit-Remaining'] = str(remaining)
+            response.headers['RateLimit-Reset'] = \
+                str(int(math.ceil(reset_after)))
+        return response
@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+'''
+Row cache
+    bounded, per-process LRU of serialized rows keyed by
+    (table name, id), kept per app in app.extensions['row_cache'] and
+    sitting in front of the single-item and multi-get
+    endpoints. The Actor/Movie write methods invalidate entries after
+    they commit. Writes in other worker processes are picked up from the
+    change log: a background thread polls it every
+    ROW_CACHE_SYNC_INTERVAL seconds and invalidates the rows it names.
+    Entries also expire after ROW_CACHE_TTL seconds, in case polling
+    fails.
+
+    Every invalidation bumps a generation counter. A reader takes the
+    generation before it queries, and put() drops its rows if the
+    generation moved in the meantime. Without this, a reader that raced
+    a write could put the old row back after the write had invalidated it.
+'''
+
+
+class RowCache(object):
+    def __init__(self, size=1024, ttl=30):
+        self.size = size
+        self.ttl = ttl
+        self.poll = None
+        self.interval = 1
+        self.watcher_pid = None
+        self.reset()
+
+    def reset(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    '''
+    watch(poll, interval)
+        `poll(seq)` returns the newest change log seq and the
+        (table, id) pairs changed after `seq`; with seq None it only
+        returns the newest seq. The polling thread starts with the first
+        read in each process, so never in gunicorn's master, and again
+        in every forked worker.
+    '''
+
+    def watch(self, poll, interval):
+        self.poll = poll
+        self.interval = interval
+
+    def _start_watcher(self):
+        with self.lock:
+            if self.poll is None or self.watcher_pid == os.getpid():
+                return
+            self.watcher_pid = os.getpid()
+        thread = threading.Thread(target=self._watch, name='row-cache-watch',
+                                  daemon=True)
+        thread.start()
+
+    def _watch(self):
+        seq = None
+        while True:
+            try:
+                seq, changed = self.poll(seq)
+                if changed:
+                    self.invalidate_many(changed)
+            except Exception:
+                # changes may have been missed; start over from scratch
+                seq = None
+                self.clear()
+            time.sleep(self.interval)
+
+    def get_many(self, table, ids):
+        self._start_watcher()
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            for row_id in ids:
+                entry = self.entries.get((table, row_id))
+                if entry is None or entry[0] < now:
+                    continue
+                self.entries.move_to_end((table, row_id))
+                found[row_id] = entry[1]
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+            return found, self.generation
+
+    def put_many(self, table, rows, generation):
+        if self.size <= 0:
+            return
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            if generation != self.generation:
+                return
+            for row_id, value in rows.items():
+                self.entries[(table, row_id)] = (expires, value)
+                self.entries.move_to_end((table, row_id))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, table, row_id):
+        self.invalidate_many([(table, row_id)])
+
+    def invalidate_many(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(tuple(key), None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+'''
+setup_row_cache(app, poll)
+    gives the app its row cache, watching the change log through `poll`
+    (see RowCache.watch), configured from app.config then the
+    environment:
+        ROW_CACHE_SIZE           rows kept per process, 0 disables it
+        ROW_CACHE_TTL            seconds a cached row may be served
+        ROW_CACHE_SYNC_INTERVAL  seconds between change log polls; a
+                                 write on another worker may be missed
+                                 for about this long
+'''
+
+
+def setup_row_cache(app, poll):
+    app.config.setdefault('ROW_CACHE_SIZE',
+                          int(os.environ.get('ROW_CACHE_SIZE', 1024)))
+    app.config.setdefault('ROW_CACHE_TTL',
+                          float(os.environ.get('ROW_CACHE_TTL', 30)))
+    app.config.setdefault('ROW_CACHE_SYNC_INTERVAL',
+                          float(os.environ.get('ROW_CACHE_SYNC_INTERVAL', 1)))
+    cache = RowCache(app.config['ROW_CACHE_SIZE'], app.config['ROW_CACHE_TTL'])
+    if cache.size > 0:
+        def poll_in_app(seq):
+            with app.app_context():
+                return poll(seq)
+
+        cache.watch(poll_in_app, app.config['ROW_CACHE_SYNC_INTERVAL'])
+    app.extensions['row_cache'] = cache
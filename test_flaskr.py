@@ -1,10 +1,15 @@
 import os
 import unittest
 import json
+import threading
+import time
+from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
 
 from app import create_app
-from models import Movie, Actor, setup_db
+from models import db, Movie, Actor, Change, ChangePruneMark, setup_db
+from json_provider import JSONProvider
+from group_commit import GroupCommitter, GroupCommitTimeout
 
 JWT_TEST_APP = open('JWT_TEST_APP.json', )
 tokens = json.load(JWT_TEST_APP)
@@ -192,6 +197,256 @@ class TriviaTestCase(unittest.TestCase):
                                         headers={'Authorization': f'Bearer {executive_producer_token}'})
         self.assertEqual(response.status_code, 404)
 
+    # Error handlers encode through the configured JSON provider
+    def test_stdlib_json_provider_encodes_errors_with_status_code_401(self):
+        client = create_app(json_provider=JSONProvider()).test_client()
+        response = client.get('/actors')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(data['message'], "JWT not found")
+
+    # Large list responses are gzipped when the client accepts it
+    def test_get_actors_gzip_compressed_with_status_code_200(self):
+        assistant_token = tokens['assistant_token']
+        client = create_app({'COMPRESS_MIN_SIZE': 0}).test_client()
+        response = client.get('/actors', headers={'Authorization': f'Bearer {assistant_token}',
+                                                  'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+    # Conditional GET with a matching ETag returns 304
+    def test_get_movies_if_none_match_with_status_code_304(self):
+        assistant_token = tokens['assistant_token']
+        headers = {'Authorization': f'Bearer {assistant_token}'}
+        response = self.client().get('/movies', headers=headers)
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client().get('/movies', headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+    # CORS preflight is answered without a JWT and can be cached
+    def test_preflight_delete_actors_without_jwt_with_status_code_200(self):
+        response = self.client().open(f'/actors/{mock_actor_id}', method='OPTIONS',
+                                      headers={'Origin': 'http://localhost:3000',
+                                               'Access-Control-Request-Method': 'DELETE'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Access-Control-Max-Age', response.headers)
+        self.assertEqual(len(response.headers.getlist('Access-Control-Allow-Origin')), 1)
+
+    # List requests are shed with 503 and Retry-After when the pool is full
+    def test_get_actors_shed_with_status_code_503(self):
+        assistant_token = tokens['assistant_token']
+        client = create_app({'ADMISSION_LIST_LIMIT': 0, 'ADMISSION_QUEUE_SIZE': 0,
+                             'METRICS_ENABLED': True}).test_client()
+        response = client.get('/actors', headers={'Authorization': f'Bearer {assistant_token}'})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        response = client.get('/metrics')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['admission']['list']['shed'], 1)
+
+    # Rate limit headers are sent and exhausted tokens get 429
+    def test_get_movies_rate_limited_with_status_code_429(self):
+        assistant_token = tokens['assistant_token']
+        client = create_app({'RATE_LIMIT_READ': '1/60'}).test_client()
+        headers = {'Authorization': f'Bearer {assistant_token}'}
+        response = client.get('/movies', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['RateLimit-Limit'], '1')
+        self.assertEqual(response.headers['RateLimit-Remaining'], '0')
+        response = client.get('/movies', headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+
+    # Change feed returns the changes written by the model methods
+    def test_permission_assistant_to_get_changes_with_status_code_200(self):
+        assistant_token = tokens['assistant_token']
+        response = self.client().get('/changes?since=0&wait=1',
+                                     headers={'Authorization': f'Bearer {assistant_token}'})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['changes'])
+        self.assertEqual(data['last_seq'], data['changes'][-1]['seq'])
+
+    # Change feed without JWT
+    def test_get_changes_with_status_code_401(self):
+        response = self.client().get('/changes?since=0')
+        self.assertEqual(response.status_code, 401)
+
+    # Change feed rejects a wait that is not a finite number
+    def test_permission_assistant_to_get_changes_wait_nan_with_status_code_400(self):
+        assistant_token = tokens['assistant_token']
+        response = self.client().get('/changes?since=0&wait=nan',
+                                     headers={'Authorization': f'Bearer {assistant_token}'})
+        self.assertEqual(response.status_code, 400)
+
+    # Change feed requests are shed once the stream pool is full
+    def test_get_changes_shed_with_status_code_503(self):
+        assistant_token = tokens['assistant_token']
+        client = create_app({'ADMISSION_STREAM_LIMIT': 0}).test_client()
+        response = client.get('/changes?since=0',
+                              headers={'Authorization': f'Bearer {assistant_token}'})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+    # Change feed tells a client behind the pruned history to re-fetch
+    def test_permission_assistant_to_get_pruned_changes_with_status_code_410(self):
+        assistant_token = tokens['assistant_token']
+        headers = {'Authorization': f'Bearer {assistant_token}'}
+        with self.app.app_context():
+            Change.prune(datetime.utcnow() + timedelta(seconds=1))
+        response = self.client().get('/changes?since=0', headers=headers)
+        data = json.loads(response.data)
+        resumed = self.client().get(f"/changes?since={data.get('latest_seq')}",
+                                    headers=headers)
+        # forget the prune mark so since=0 works for the other tests
+        with self.app.app_context():
+            ChangePruneMark.query.delete()
+            db.session.commit()
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(data['reset'])
+        self.assertEqual(resumed.status_code, 200)
+
+    # Delta sync returns deleted ids since the given timestamp
+    def test_get_actors_updated_since_with_deleted_ids_status_code_200(self):
+        director_token = tokens['director_token']
+        headers = {'Authorization': f'Bearer {director_token}'}
+        # updated_at comes from the database clock, allow for its resolution
+        since = (datetime.utcnow() - timedelta(seconds=1)).isoformat() + 'Z'
+        self.client().delete(f'/actors/{mock_actor2_id}', headers=headers)
+        response = self.client().get(f'/actors?updated_since={since}', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(mock_actor2_id, data['deleted_ids'])
+
+    # A write that commits after a sync, stamped before that sync's
+    # newest row, is still returned by the next sync
+    def test_get_actors_updated_since_returns_late_commit(self):
+        assistant_token = tokens['assistant_token']
+        headers = {'Authorization': f'Bearer {assistant_token}'}
+        since = (datetime.utcnow() - timedelta(minutes=1)).isoformat() + 'Z'
+        response = self.client().get(f'/actors?updated_since={since}', headers=headers)
+        cursor = json.loads(response.data)['next_updated_since']
+        with self.app.app_context():
+            newest = Actor.query.order_by(Actor.updated_at.desc()).first()
+            late = Actor(name='LATE COMMIT', age=40, gender='F')
+            late.updated_at = newest.updated_at - timedelta(seconds=1)
+            late.insert()
+            late_id = late.id
+        response = self.client().get(f'/actors?updated_since={cursor}', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(late_id, [actor['id'] for actor in data['actors']])
+
+    # Delta sync with a malformed timestamp
+    def test_get_movies_updated_since_malformed_with_status_code_400(self):
+        assistant_token = tokens['assistant_token']
+        response = self.client().get('/movies?updated_since=yesterday',
+                                     headers={'Authorization': f'Bearer {assistant_token}'})
+        self.assertEqual(response.status_code, 400)
+
+    # Permission of assistant to get a single actor
+    def test_permission_assistant_to_get_actor_with_status_code_200(self):
+        assistant_token = tokens['assistant_token']
+        response = self.client().get(f'/actors/{mock_actor2_id}',
+                                     headers={'Authorization': f'Bearer {assistant_token}'})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['actor']['id'], mock_actor2_id)
+
+    # Single movie that does not exist
+    def test_permission_assistant_to_get_movie_with_status_code_404(self):
+        assistant_token = tokens['assistant_token']
+        response = self.client().get('/movies/88888888',
+                                     headers={'Authorization': f'Bearer {assistant_token}'})
+        self.assertEqual(response.status_code, 404)
+
+    # A row cached by one worker is refreshed after another worker's write
+    def test_row_cache_sees_update_from_other_worker(self):
+        headers = {'Authorization': f"Bearer {tokens['director_token']}"}
+        reader = create_app({'ROW_CACHE_SYNC_INTERVAL': 0.1}).test_client()
+        writer = create_app().test_client()
+        reader.get(f'/actors/{mock_actor_id}', headers=headers)
+        time.sleep(0.3)
+        writer.patch(f'/actors/{mock_actor_id}', data=json.dumps({'name': 'OTHER WORKER'}),
+                     content_type='application/json', headers=headers)
+        time.sleep(0.3)
+        response = reader.get(f'/actors/{mock_actor_id}', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['actor']['name'], 'OTHER WORKER')
+
+    # Multi-get returns the listed movies that exist
+    def test_permission_assistant_to_multi_get_movies_with_status_code_200(self):
+        assistant_token = tokens['assistant_token']
+        response = self.client().get(f'/movies?ids={mock_movie2_id},88888888',
+                                     headers={'Authorization': f'Bearer {assistant_token}'})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['id'] for m in data['movies']], [mock_movie2_id])
+
+    # Creating an actor through group commit still returns its id
+    def test_group_commit_post_actor_with_status_200(self):
+        director_token = tokens['director_token']
+        client = create_app({'GROUP_COMMIT': True}).test_client()
+        response = client.post('/actors', data=json.dumps({
+            'name': 'GROUP COMMIT',
+            'age': '40',
+            'gender': 'F',
+        }), content_type='application/json', headers={'Authorization': f'Bearer {director_token}'})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(data['actor']['id'])
+        self.assertFalse(self.app.extensions['group_commit'].enabled)
+
+    # A create in a stuck batch gives up instead of hanging
+    def test_group_commit_follower_times_out(self):
+        release = threading.Event()
+
+        def flush(records):
+            release.wait(5)
+            return [None] * len(records)
+
+        committer = GroupCommitter(flush, window=5, max_batch=2, timeout=0.1)
+        leader = threading.Thread(target=committer.submit, args=('first',))
+        leader.start()
+        while not committer.pending:
+            time.sleep(0.01)
+        with self.assertRaises(GroupCommitTimeout):
+            committer.submit('second')
+        release.set()
+        leader.join()
+
+    # Actor stats are kept up to date by the model write methods
+    def test_permission_assistant_to_get_actor_stats_with_status_code_200(self):
+        assistant_token = tokens['assistant_token']
+        response = self.client().get('/stats/actors',
+                                     headers={'Authorization': f'Bearer {assistant_token}'})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(data['total'], 2)
+        self.assertGreaterEqual(data['by_age']['30-39'], 2)
+
+    # Movie stats without JWT
+    def test_get_movie_stats_with_status_code_401(self):
+        response = self.client().get('/stats/movies')
+        self.assertEqual(response.status_code, 401)
+
+    # Startup time of the app is reported by /metrics
+    def test_metrics_reports_startup_time(self):
+        client = create_app({'METRICS_ENABLED': True}).test_client()
+        response = client.get('/metrics')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(data['startup_ms'], 0)
+
+    # Metrics are not served unless enabled
+    def test_metrics_disabled_with_status_code_404(self):
+        response = self.client().get('/metrics')
+        self.assertEqual(response.status_code, 404)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":